@@ -11,14 +11,24 @@ aggregates them into ai-fix-metrics.json with:
 
 Raw events older than 7 days are cleaned up after aggregation.
 The aggregator is idempotent -- running it multiple times on the same
-events produces the same result thanks to processed-ID tracking.
+events produces the same result thanks to processed-ID tracking. Events
+whose ID was already processed are not downloaded again; their
+contribution is carried forward in the stored summary, trends and
+recent runs.
 """
 
 import argparse
-import json
+import cProfile
+import functools
+import heapq
+import pstats
 import sys
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from itertools import chain
+
+import orjson
 
 GCS_BUCKET = "bazel-metrics-data"
 EVENTS_PREFIX = "ai-fix-events/"
@@ -27,6 +37,18 @@ TREND_DAYS = 30
 TREND_WEEKS = 26
 EVENT_RETENTION_DAYS = 7
 RECENT_RUNS_LIMIT = 50
+EVENT_PREFIXES = [
+    "ai-fix-events/post-merge/",
+    "ai-fix-events/pre-merge/",
+    "ai-fix-events/user-applied/",
+]
+# Maps an event's workflow to its per-workflow block in the summary.
+WORKFLOW_SUMMARY_KEYS = {"post-merge": "postMerge", "pre-merge": "preMerge"}
+GCS_WORKERS = 32
+LIST_PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 100
+PROFILE_TOP_N = 30
+HTTP_POOL_SIZE = 64
 
 
 def empty_summary():
@@ -53,179 +75,286 @@ def empty_summary():
 
 
 def parse_ts(ts_str):
+    if not isinstance(ts_str, str):
+        return None
+    return _parse_iso_ts(ts_str)
+
+
+@functools.lru_cache(maxsize=100_000)
+def _parse_iso_ts(ts_str):
     try:
         return datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
-    except (ValueError, TypeError, AttributeError):
+    except ValueError:
         return None
 
 
-def iso_week_start(dt):
-    """Return the Monday (start) of the ISO week containing dt."""
-    return (dt - timedelta(days=dt.weekday())).strftime("%Y-%m-%d")
+@functools.lru_cache(maxsize=1024)
+def iso_week_start(day):
+    """Return the Monday (start) of the ISO week containing the date day."""
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def iso_week_label(day):
+    """Return the ISO week label (e.g. 2025-W01) of the week containing day."""
+    iso_year, iso_week, _ = day.isocalendar()
+    return f"{iso_year}-W{iso_week:02d}"
 
 
 def load_existing_metrics(bucket, output_key):
-    blob = bucket.blob(output_key)
-    if blob.exists():
-        return json.loads(blob.download_as_text())
-    return None
+    from google.cloud.exceptions import NotFound
+
+    try:
+        return orjson.loads(bucket.blob(output_key).download_as_bytes(single_shot_download=True))
+    except NotFound:
+        return None
+
+
+def list_event_blobs(bucket, fields):
+    """List event blobs, fetching only the given object metadata fields."""
+    blobs = []
+    for prefix in EVENT_PREFIXES:
+        blobs.extend(bucket.list_blobs(prefix=prefix, fields=fields, page_size=LIST_PAGE_SIZE))
+    return blobs
+
+
+def download_event(blob):
+    # Events are a few hundred bytes; fetch each in one GET instead of chunked reads.
+    event = orjson.loads(blob.download_as_bytes(single_shot_download=True))
+    if not isinstance(event, dict):
+        raise ValueError("event is not a JSON object")
+    return event
 
 
-def load_events(bucket):
+def event_id_from_blob_name(name):
+    """Guess an event's ID from its blob name, assuming <prefix><event id>.json.
+
+    The naming is set by the workflows that write the events and is not
+    enforced here. Blobs named differently never match a processed ID, so
+    they are downloaded and deduplicated by aggregate() instead of skipped.
+    """
+    return name.rsplit("/", 1)[-1].removesuffix(".json")
+
+
+def load_events(bucket, processed_ids=frozenset()):
+    """Download unprocessed events.
+
+    Returns (events, skipped_ids), where skipped_ids are the IDs of blobs
+    that were not downloaded because they were already processed.
+    """
     events = []
-    for prefix in [
-        "ai-fix-events/post-merge/",
-        "ai-fix-events/pre-merge/",
-        "ai-fix-events/user-applied/",
-    ]:
-        for blob in bucket.list_blobs(prefix=prefix):
+    skipped_ids = set()
+    pending = []
+    for blob in list_event_blobs(bucket, fields="items(name),nextPageToken"):
+        eid = event_id_from_blob_name(blob.name)
+        if eid in processed_ids:
+            skipped_ids.add(eid)
+        else:
+            pending.append(blob)
+
+    with ThreadPoolExecutor(max_workers=GCS_WORKERS) as executor:
+        futures = [(blob, executor.submit(download_event, blob)) for blob in pending]
+        # Collect in listing order so later events deterministically win
+        # when they overwrite earlier ones (e.g. disabled tests).
+        for blob, future in futures:
             try:
-                event = json.loads(blob.download_as_text())
-                event["_blob_name"] = blob.name
-                events.append(event)
-            except (json.JSONDecodeError, Exception) as e:
+                events.append(future.result())
+            except (orjson.JSONDecodeError, Exception) as e:
                 print(f"Warning: failed to parse {blob.name}: {e}", file=sys.stderr)
-    return events
+    return events, skipped_ids
 
 
-def tally_event(counts, event):
-    """Increment trend counters for a single event."""
-    if event.get("type") == "user_applied":
-        counts["applied"] += 1
-        return
-    counts["invocations"] += 1
-    status = event.get("status", "failure")
+class TrendCounts:
+    """Trend counters for a single day or week."""
+
+    __slots__ = ("invocations", "successful", "failed", "disabled", "applied")
+
+    def __init__(self):
+        self.invocations = self.successful = self.failed = self.disabled = self.applied = 0
+
+    @classmethod
+    def from_dict(cls, entry):
+        counts = cls()
+        counts.invocations = entry.get("invocations", 0)
+        counts.successful = entry.get("successful", 0)
+        counts.failed = entry.get("failed", 0)
+        counts.disabled = entry.get("disabled", 0)
+        counts.applied = entry.get("applied", 0)
+        return counts
+
+    def as_dict(self):
+        return {
+            "invocations": self.invocations,
+            "successful": self.successful,
+            "failed": self.failed,
+            "disabled": self.disabled,
+            "applied": self.applied,
+        }
+
+
+def tally_run(counts, status, applied):
+    """Increment trend counters for a single fix run."""
+    counts.invocations += 1
     if status == "success":
-        counts["successful"] += 1
+        counts.successful += 1
     elif status == "disabled":
-        counts["disabled"] += 1
+        counts.disabled += 1
     else:
-        counts["failed"] += 1
-    if event.get("applied") == "auto-label":
-        counts["applied"] += 1
+        counts.failed += 1
+    if applied == "auto-label":
+        counts.applied += 1
+
 
+def build_recent_run(event):
+    return {
+        "id": event.get("id") or "",
+        "timestamp": event.get("timestamp") or "",
+        "workflow": event.get("workflow") or "",
+        "status": event.get("status") or "failure",
+        "targets": event.get("targets") or [],
+        "attempts": event.get("attempts", 0),
+        "prUrl": event.get("prUrl"),
+        "prNumber": event.get("prNumber"),
+        "applied": event.get("applied") or "",
+    }
 
-def aggregate(stored_data, all_events, trend_days, trend_weeks, retention_days):
+
+def aggregate(
+    stored_data,
+    all_events,
+    trend_days=TREND_DAYS,
+    trend_weeks=TREND_WEEKS,
+    skipped_ids=frozenset(),
+):
+    """Fold new events into the stored metrics.
+
+    skipped_ids are IDs of events still present in GCS whose bodies were
+    not loaded because a previous run already processed them.
+    """
     now = datetime.now(timezone.utc)
-    retention_cutoff_day = (now - timedelta(days=retention_days)).strftime("%Y-%m-%d")
 
     if stored_data:
         summary = stored_data.get("summary", empty_summary())
         disabled_tests = {t["target"]: t for t in stored_data.get("disabledTests", [])}
         processed_ids = set(stored_data.get("_processedIds", []))
-        stored_daily = {e["date"]: e for e in stored_data.get("dailyTrend", [])}
-        stored_weekly = {e["weekStart"]: e for e in stored_data.get("weeklyTrend", [])}
+        stored_daily = stored_data.get("dailyTrend", [])
+        stored_weekly = stored_data.get("weeklyTrend", [])
+        stored_runs = stored_data.get("recentRuns", [])
     else:
         summary = empty_summary()
         disabled_tests = {}
         processed_ids = set()
-        stored_daily = {}
-        stored_weekly = {}
-
-    fix_events = [e for e in all_events if e.get("workflow") in ("post-merge", "pre-merge")]
-    apply_events = [e for e in all_events if e.get("type") == "user_applied"]
-
-    for event in fix_events:
-        eid = event.get("id", "")
+        stored_daily = []
+        stored_weekly = []
+        stored_runs = []
+
+    current_ids = frozenset(e["id"] for e in all_events if e.get("id")).union(skipped_ids)
+
+    fix_events = []
+    apply_events = []
+    for event in all_events:
+        workflow = event.get("workflow")
+        if workflow == "post-merge" or workflow == "pre-merge":
+            fix_events.append(event)
+        elif event.get("type") == "user_applied":
+            apply_events.append(event)
+
+    # Trends and recent runs are carried forward and only new events are
+    # added, so processed events never need to be downloaded again.
+    daily_counts = defaultdict(TrendCounts)
+    for entry in stored_daily:
+        daily_counts[entry["date"]] = TrendCounts.from_dict(entry)
+    weekly_counts = defaultdict(TrendCounts)
+    for entry in stored_weekly:
+        weekly_counts[entry["weekStart"]] = TrendCounts.from_dict(entry)
+    # Recent-run candidates are (timestamp, run or event, is_new_event);
+    # dicts for new events are only built for the runs that make the cut.
+    # Runs whose event has been cleaned up drop out of the list.
+    run_candidates = [(r.get("timestamp") or "", r, False) for r in stored_runs if r.get("id") in current_ids]
+
+    # Single pass over events: the timestamp is parsed once and feeds the
+    # trend counters, recent runs and the summary.
+    for event in chain(fix_events, apply_events):
+        eid = event.get("id") or ""
         if not eid or eid in processed_ids:
             continue
         processed_ids.add(eid)
 
-        status = event.get("status", "failure")
-        workflow = event.get("workflow", "")
-        wf_key = "postMerge" if workflow == "post-merge" else "preMerge"
+        timestamp = event.get("timestamp") or ""
+        ts = parse_ts(timestamp)
+        if ts:
+            day = ts.date()
+            trend_counts = (daily_counts[day.isoformat()], weekly_counts[iso_week_start(day)])
+        else:
+            trend_counts = ()
+
+        # A fix workflow wins over type, so an event carrying both counts as
+        # a fix run.
+        workflow = event.get("workflow")
+        if workflow != "post-merge" and workflow != "pre-merge":
+            summary["userAppliedFixes"] += 1
+            for counts in trend_counts:
+                counts.applied += 1
+            continue
+
+        status = event.get("status") or "failure"
+        applied = event.get("applied") or ""
+        targets = event.get("targets") or []
+        wf_summary = summary[WORKFLOW_SUMMARY_KEYS[workflow]]
+
+        for counts in trend_counts:
+            tally_run(counts, status, applied)
+
+        run_candidates.append((timestamp, event, True))
 
         summary["totalInvocations"] += 1
-        summary[wf_key]["totalInvocations"] += 1
+        wf_summary["totalInvocations"] += 1
 
         if status == "success":
             summary["successfulFixes"] += 1
-            summary[wf_key]["successfulFixes"] += 1
+            wf_summary["successfulFixes"] += 1
         elif status == "disabled":
             summary["testsDisabled"] += 1
-            summary[wf_key]["testsDisabled"] += 1
+            wf_summary["testsDisabled"] += 1
         else:
             summary["failedFixes"] += 1
-            summary[wf_key]["failedFixes"] += 1
+            wf_summary["failedFixes"] += 1
 
-        if event.get("applied") == "auto-label":
+        if applied == "auto-label":
             summary["autoAppliedFixes"] += 1
 
         if status == "disabled" or event.get("fixType") == "test_disabled":
-            for target in event.get("targets", []):
+            reason = event.get("reason") or ""
+            for target in targets:
                 disabled_tests[target] = {
                     "target": target,
-                    "disabledAt": event.get("timestamp", ""),
+                    "disabledAt": timestamp,
                     "workflow": workflow,
-                    "reason": event.get("reason") or "",
+                    "reason": reason,
                     "runId": eid,
                 }
 
-    for event in apply_events:
-        eid = event.get("id", "")
-        if not eid or eid in processed_ids:
-            continue
-        processed_ids.add(eid)
-        summary["userAppliedFixes"] += 1
-
-    # --- Build trend data from raw events ---
-    zeros = {"invocations": 0, "successful": 0, "failed": 0, "disabled": 0, "applied": 0}
-    daily_counts = defaultdict(lambda: dict(zeros))
-    weekly_counts = defaultdict(lambda: dict(zeros))
-
-    for event in fix_events + apply_events:
-        ts = parse_ts(event.get("timestamp", ""))
-        if not ts:
-            continue
-        day = ts.strftime("%Y-%m-%d")
-        week = iso_week_start(ts)
-        tally_event(daily_counts[day], event)
-        tally_event(weekly_counts[week], event)
+    today = now.date()
 
     # Daily trend (last 30 days)
     daily_trend = []
     for i in range(trend_days):
-        day = (now - timedelta(days=trend_days - 1 - i)).strftime("%Y-%m-%d")
-        if day >= retention_cutoff_day:
-            daily_trend.append({"date": day, **daily_counts.get(day, zeros)})
-        elif day in stored_daily:
-            daily_trend.append(stored_daily[day])
-        else:
-            daily_trend.append({"date": day, **zeros})
+        day = (today - timedelta(days=trend_days - 1 - i)).isoformat()
+        daily_trend.append({"date": day, **daily_counts[day].as_dict()})
 
     # Weekly trend (last 26 weeks / 180 days)
-    retention_cutoff_week = iso_week_start(now - timedelta(days=retention_days))
+    this_monday = today - timedelta(days=today.weekday())
     weekly_trend = []
     for i in range(trend_weeks):
-        week_dt = now - timedelta(weeks=trend_weeks - 1 - i)
-        week_start = iso_week_start(week_dt)
-        week_label = week_dt.strftime("%Y-W%V")
-        if week_start >= retention_cutoff_week and week_start in weekly_counts:
-            weekly_trend.append({"week": week_label, "weekStart": week_start, **weekly_counts[week_start]})
-        elif week_start in stored_weekly:
-            weekly_trend.append(stored_weekly[week_start])
-        else:
-            weekly_trend.append({"week": week_label, "weekStart": week_start, **zeros})
+        monday = this_monday - timedelta(weeks=trend_weeks - 1 - i)
+        week_start = monday.isoformat()
+        week_label = iso_week_label(monday)
+        weekly_trend.append({"week": week_label, "weekStart": week_start, **weekly_counts[week_start].as_dict()})
 
     # Recent runs
-    recent_runs = []
-    for event in fix_events:
-        recent_runs.append({
-            "id": event.get("id", ""),
-            "timestamp": event.get("timestamp", ""),
-            "workflow": event.get("workflow", ""),
-            "status": event.get("status", "failure"),
-            "targets": event.get("targets", []),
-            "attempts": event.get("attempts", 0),
-            "prUrl": event.get("prUrl"),
-            "prNumber": event.get("prNumber"),
-            "applied": event.get("applied", ""),
-        })
-    recent_runs.sort(key=lambda r: r.get("timestamp", ""), reverse=True)
-    recent_runs = recent_runs[:RECENT_RUNS_LIMIT]
-
-    current_ids = {e.get("id") for e in all_events if e.get("id")}
-    processed_ids = processed_ids & current_ids
+    top_runs = heapq.nlargest(RECENT_RUNS_LIMIT, run_candidates, key=lambda c: c[0])
+    recent_runs = [build_recent_run(item) if is_new else item for _, item, is_new in top_runs]
+
+    processed_ids.intersection_update(current_ids)
 
     return {
         "timestamp": now.isoformat(),
@@ -240,22 +369,22 @@ def aggregate(stored_data, all_events, trend_days, trend_weeks, retention_days):
 
 def cleanup_old_events(bucket, retention_days):
     cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
-    deleted = 0
-    for prefix in [
-        "ai-fix-events/post-merge/",
-        "ai-fix-events/pre-merge/",
-        "ai-fix-events/user-applied/",
-    ]:
-        for blob in bucket.list_blobs(prefix=prefix):
-            if blob.updated and blob.updated < cutoff:
+    blobs = list_event_blobs(bucket, fields="items(name,updated),nextPageToken")
+    expired = [blob for blob in blobs if blob.updated and blob.updated < cutoff]
+    # A GCS batch request carries up to 100 calls in one HTTP round trip.
+    for start in range(0, len(expired), DELETE_BATCH_SIZE):
+        chunk = expired[start:start + DELETE_BATCH_SIZE]
+        with bucket.client.batch():
+            for blob in chunk:
                 blob.delete()
-                deleted += 1
-                print(f"Deleted old event: {blob.name}")
-    print(f"Cleaned up {deleted} events older than {retention_days} days")
+        for blob in chunk:
+            print(f"Deleted old event: {blob.name}")
+    print(f"Cleaned up {len(expired)} events older than {retention_days} days")
 
 
 def main():
     from google.cloud import storage
+    from requests.adapters import HTTPAdapter
 
     parser = argparse.ArgumentParser(description="Aggregate AI fix metrics from GCS")
     parser.add_argument("--bucket", default=GCS_BUCKET)
@@ -264,20 +393,42 @@ def main():
     parser.add_argument("--trend-days", type=int, default=TREND_DAYS)
     parser.add_argument("--trend-weeks", type=int, default=TREND_WEEKS)
     parser.add_argument("--dry-run", action="store_true", help="Print output without uploading")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile event loading and aggregation and print the top calls by cumulative time to stderr",
+    )
     args = parser.parse_args()
 
     client = storage.Client()
+    # The default pool (10 connections) is smaller than GCS_WORKERS, which
+    # would serialize requests and log "Connection pool is full" warnings.
+    # client._http is a private attribute of the storage client (its
+    # requests session) and may change between library versions.
+    client._http.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
     bucket = client.bucket(args.bucket)
 
     print(f"Loading existing metrics from gs://{args.bucket}/{args.output_key}...")
     existing = load_existing_metrics(bucket, args.output_key)
 
+    processed_ids = set(existing.get("_processedIds", [])) if existing else set()
+
+    # Download workers run on their own threads, so network time shows up
+    # here as time spent waiting on futures in load_events.
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
     print(f"Loading raw events from gs://{args.bucket}/ai-fix-events/...")
-    events = load_events(bucket)
-    print(f"Found {len(events)} raw events")
+    events, skipped_ids = load_events(bucket, processed_ids)
+    print(f"Found {len(events)} new raw events ({len(skipped_ids)} already processed)")
 
     print("Aggregating...")
-    result = aggregate(existing, events, args.trend_days, args.trend_weeks, args.retention_days)
+    result = aggregate(existing, events, args.trend_days, args.trend_weeks, skipped_ids)
+
+    if profiler:
+        profiler.disable()
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
 
     s = result["summary"]
     print(f"  Total invocations: {s['totalInvocations']}")
@@ -292,12 +443,12 @@ def main():
 
     if args.dry_run:
         public = {k: v for k, v in result.items() if not k.startswith("_")}
-        print(json.dumps(public, indent=2))
+        print(orjson.dumps(public, option=orjson.OPT_INDENT_2).decode())
         return
 
     print(f"Uploading to gs://{args.bucket}/{args.output_key}...")
     blob = bucket.blob(args.output_key)
-    blob.upload_from_string(json.dumps(result, indent=2), content_type="application/json")
+    blob.upload_from_string(orjson.dumps(result, option=orjson.OPT_INDENT_2), content_type="application/json")
 
     cleanup_old_events(bucket, args.retention_days)
     print("Done!")
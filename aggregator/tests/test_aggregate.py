@@ -1,7 +1,9 @@
 import unittest
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 
-from aggregator.aggregate import aggregate, empty_summary
+import orjson
+
+from aggregator.aggregate import aggregate, empty_summary, iso_week_label, load_events
 
 
 def iso(days_offset: int) -> str:
@@ -26,12 +28,45 @@ class AggregateTests(unittest.TestCase):
                 "timestamp": iso(-1),
             },
         ]
-        first = aggregate(None, events, trend_days=7, retention_days=7)
-        second = aggregate(first, events, trend_days=7, retention_days=7)
+        first = aggregate(None, events, trend_days=7)
+        second = aggregate(first, events, trend_days=7)
+
+        self.assertEqual(first["summary"], second["summary"])
+        self.assertEqual(first["_processedIds"], second["_processedIds"])
+
+    def test_skipped_processed_events_are_carried_forward(self):
+        events = [
+            {
+                "id": "post-4-1",
+                "timestamp": iso(-1),
+                "workflow": "post-merge",
+                "status": "failure",
+                "targets": ["//go/pkg/baz:baz_test"],
+            },
+            {
+                "id": "apply-4-1",
+                "type": "user_applied",
+                "timestamp": iso(-2),
+            },
+        ]
+        first = aggregate(None, events, trend_days=7)
+        second = aggregate(first, [], trend_days=7, skipped_ids={"post-4-1", "apply-4-1"})
 
         self.assertEqual(first["summary"], second["summary"])
+        self.assertEqual(first["dailyTrend"], second["dailyTrend"])
+        self.assertEqual(first["weeklyTrend"], second["weeklyTrend"])
+        self.assertEqual(first["recentRuns"], second["recentRuns"])
         self.assertEqual(first["_processedIds"], second["_processedIds"])
 
+    def test_recent_runs_drop_cleaned_up_events(self):
+        events = [{"id": "post-5-1", "timestamp": iso(-1), "workflow": "post-merge", "status": "success"}]
+        first = aggregate(None, events, trend_days=7)
+        second = aggregate(first, [], trend_days=7)
+
+        self.assertEqual(second["recentRuns"], [])
+        self.assertEqual(second["_processedIds"], [])
+        self.assertEqual(first["dailyTrend"], second["dailyTrend"])
+
     def test_disabled_reason_is_normalized_to_string(self):
         events = [
             {
@@ -44,12 +79,53 @@ class AggregateTests(unittest.TestCase):
                 "reason": None,
             }
         ]
-        result = aggregate(None, events, trend_days=7, retention_days=7)
+        result = aggregate(None, events, trend_days=7)
 
         self.assertEqual(len(result["disabledTests"]), 1)
         self.assertEqual(result["disabledTests"][0]["reason"], "")
 
-    def test_preserves_historical_trend_outside_retention(self):
+    def test_unhashable_timestamp_is_skipped_in_trends(self):
+        events = [
+            {
+                "id": "post-3-1",
+                "timestamp": ["not", "a", "string"],
+                "workflow": "post-merge",
+                "status": "success",
+            }
+        ]
+        result = aggregate(None, events, trend_days=7)
+
+        self.assertEqual(result["summary"]["successfulFixes"], 1)
+        self.assertEqual(sum(entry["invocations"] for entry in result["dailyTrend"]), 0)
+
+    def test_unhashable_workflow_is_ignored(self):
+        events = [
+            {"id": "post-6-1", "timestamp": iso(-1), "workflow": ["post-merge"], "status": "success"},
+            {"id": "post-6-2", "timestamp": iso(-1), "workflow": "post-merge", "status": "success"},
+        ]
+        result = aggregate(None, events, trend_days=7)
+
+        self.assertEqual(result["summary"]["totalInvocations"], 1)
+        self.assertEqual([run["id"] for run in result["recentRuns"]], ["post-6-2"])
+
+    def test_fix_workflow_takes_precedence_over_user_applied_type(self):
+        events = [
+            {
+                "id": "post-9-1",
+                "type": "user_applied",
+                "timestamp": iso(-1),
+                "workflow": "post-merge",
+                "status": "success",
+            }
+        ]
+        result = aggregate(None, events, trend_days=7)
+
+        self.assertEqual(result["summary"]["totalInvocations"], 1)
+        self.assertEqual(result["summary"]["postMerge"]["successfulFixes"], 1)
+        self.assertEqual(result["summary"]["userAppliedFixes"], 0)
+        self.assertEqual([run["id"] for run in result["recentRuns"]], ["post-9-1"])
+
+    def test_new_events_are_added_to_stored_trend(self):
         old_day = (datetime.now(timezone.utc) - timedelta(days=3)).strftime("%Y-%m-%d")
         stored = {
             "summary": empty_summary(),
@@ -66,11 +142,70 @@ class AggregateTests(unittest.TestCase):
             "disabledTests": [],
             "_processedIds": [],
         }
-        result = aggregate(stored, [], trend_days=5, retention_days=1)
+        events = [{"id": "post-7-1", "timestamp": iso(-3), "workflow": "post-merge", "status": "success"}]
+        result = aggregate(stored, events, trend_days=5)
         entry = next(item for item in result["dailyTrend"] if item["date"] == old_day)
 
-        self.assertEqual(entry["invocations"], 9)
-        self.assertEqual(entry["successful"], 8)
+        self.assertEqual(entry["invocations"], 10)
+        self.assertEqual(entry["successful"], 9)
+        self.assertEqual(entry["failed"], 1)
+        self.assertEqual(entry["applied"], 4)
+
+
+class WeekLabelTests(unittest.TestCase):
+    def test_week_straddling_new_year_uses_iso_year(self):
+        self.assertEqual(iso_week_label(date(2024, 12, 30)), "2025-W01")
+        self.assertEqual(iso_week_label(date(2021, 1, 4)), "2021-W01")
+        self.assertEqual(iso_week_label(date(2020, 12, 28)), "2020-W53")
+
+
+class FakeBlob:
+    def __init__(self, name, event):
+        self.name = name
+        self.payload = orjson.dumps(event)
+        self.downloaded = False
+
+    def download_as_bytes(self, single_shot_download=False):
+        self.downloaded = True
+        return self.payload
+
+
+class FakeBucket:
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def list_blobs(self, prefix, fields=None, page_size=None):
+        return [blob for blob in self.blobs if blob.name.startswith(prefix)]
+
+
+class LoadEventsTests(unittest.TestCase):
+    def test_skips_blobs_whose_id_was_processed(self):
+        processed = FakeBlob("ai-fix-events/post-merge/post-8-1.json", {"id": "post-8-1"})
+        unprocessed = FakeBlob("ai-fix-events/pre-merge/pre-8-2.json", {"id": "pre-8-2"})
+        # Name doesn't encode the ID, so it can't be skipped even though
+        # the ID inside was already processed.
+        unmatched = FakeBlob("ai-fix-events/user-applied/2024/run.json", {"id": "apply-8-3"})
+        bucket = FakeBucket([processed, unprocessed, unmatched])
+
+        events, skipped_ids = load_events(bucket, {"post-8-1", "apply-8-3"})
+
+        self.assertEqual(skipped_ids, {"post-8-1"})
+        self.assertEqual([e["id"] for e in events], ["pre-8-2", "apply-8-3"])
+        self.assertFalse(processed.downloaded)
+        self.assertTrue(unprocessed.downloaded)
+        self.assertTrue(unmatched.downloaded)
+
+    def test_skips_payloads_that_are_not_json_objects(self):
+        bucket = FakeBucket([
+            FakeBlob("ai-fix-events/post-merge/post-10-1.json", []),
+            FakeBlob("ai-fix-events/post-merge/post-10-2.json", None),
+            FakeBlob("ai-fix-events/pre-merge/pre-10-3.json", "oops"),
+            FakeBlob("ai-fix-events/pre-merge/pre-10-4.json", {"id": "pre-10-4"}),
+        ])
+
+        events, _ = load_events(bucket)
+
+        self.assertEqual(events, [{"id": "pre-10-4"}])
 
 
 if __name__ == "__main__":